@@ -1,14 +1,97 @@
-from flask import Flask, request, abort, jsonify
+from flask import Flask, request, abort, jsonify, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-import random
+from sqlalchemy import func, lambda_stmt, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import configure_mappers
+import hashlib
+import math
+import orjson
 
-from models import setup_db, Question, Category, db
+from models import setup_db, count_questions, get_categories_map, Question, db
 
 QUESTIONS_PER_PAGE = 10
+STREAM_BATCH_SIZE = 500
+
+# the same for every response, so built once rather than added header by header
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,Authorization,true',
+    'Access-Control-Allow-Methods': 'GET,PUT,POST,DELETE,OPTIONS',
+    'Access-Control-Allow-Credentials': 'true'
+}
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Serializes responses with orjson, a C extension that is several times faster than the json module.
+    """
+    def dumps(self, obj, **kwargs):
+        # category maps are keyed by integer id, which orjson only accepts with OPT_NON_STR_KEYS
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+def select_questions():
+    """
+    Selects the fields of Question.format() as plain rows, skipping ORM object loading.
+
+    The statement is a lambda_stmt, so SQLAlchemy caches the construct itself and
+    criteria are appended as lambdas, e.g. `selection += lambda s: s.where(...)`.
+    """
+    return lambda_stmt(lambda: select(Question.id, Question.question, Question.answer,
+                                      Question.category, Question.difficulty))
+
+def question_fields(body):
+    """
+    Returns the columns of a new question from a request body, or None if any are missing.
+    """
+    if not isinstance(body, dict):
+        return None
+
+    fields = {key: body.get(key, None) for key in ('question', 'answer', 'category', 'difficulty')}
+
+    if not all(fields.values()):
+        return None
+
+    return fields
+
+def count_requested():
+    """
+    Returns False if the client passed ?count=false to skip the totals and the COUNT behind them.
+    """
+    return request.args.get('count', 'true').lower() != 'false'
+
+def paginate_questions(selection):
+    """
+    Returns one page of the selection, the page number served (None for keyset pages)
+    and the id to pass as ?after_id= for the next page.
+
+    Pages are addressed by ?after_id= (keyset) or, for older clients, by ?page=.
+    One extra row is fetched to tell whether a next page exists, so no COUNT is issued.
+    """
+    limit = QUESTIONS_PER_PAGE + 1
+    selection += lambda s: s.order_by(Question.id).limit(limit)
+
+    page = None
+    after_id = request.args.get('after_id', None, type=int)
+    if after_id is not None:
+        selection += lambda s: s.where(Question.id > after_id)
+    else:
+        page = max(request.args.get('page', 1, type=int), 1)
+        offset = (page - 1) * QUESTIONS_PER_PAGE
+        selection += lambda s: s.offset(offset)
+
+    rows = db.session.execute(selection).mappings().all()
+    questions = [dict(row) for row in rows[:QUESTIONS_PER_PAGE]]
+    next_after_id = questions[-1]['id'] if len(rows) > QUESTIONS_PER_PAGE else None
+
+    return questions, page, next_after_id
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    app.json = OrjsonProvider(app)
 
     CORS(app) # Initialize CORS here
 
@@ -21,57 +104,60 @@ def create_app(test_config=None):
     # Use the after_request decorator to set Access-Control-Allow headers
     @app.after_request
     def after_request(response):
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,true')
-        response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
-        response.headers.add('Access-Control-Allow-Credentials', 'true')
+        response.headers.update(CORS_HEADERS)
         return response
 
     @app.route('/categories')
     def get_categories():
         """
         Handles GET requests for all available categories.
+        Clients that send the ETag back in If-None-Match get an empty 304 while the categories are unchanged.
         """
-        categories = Category.query.all()
-        formatted_categories = {category.id: category.type for category in categories}
+        categories = get_categories_map()
 
-        return jsonify({
+        response = jsonify({
             'success': True,
-            'categories': formatted_categories
+            'categories': categories
         })
+        response.set_etag(hashlib.blake2b(
+            orjson.dumps(categories, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS),
+            digest_size=8
+        ).hexdigest())
+
+        return response.make_conditional(request)
 
     @app.route('/questions') 
     def get_questions():
         """
         Handles GET requests for questions, including pagination.
         """
-        page = request.args.get('page', 1, type=int)
-
-        pagination = Question.query.order_by(Question.id).paginate(page=page, per_page=QUESTIONS_PER_PAGE, error_out=False)
-        paginated_questions = [question.format() for question in pagination.items]
+        paginated_questions, page, next_after_id = paginate_questions(select_questions())
 
         if not paginated_questions:
             abort(404)
 
-        categories = Category.query.all()
-        formatted_categories = {category.id: category.type for category in categories}
-
-        return jsonify({
+        response = {
             'success': True,
             'questions': paginated_questions,
-            'total_questions': pagination.total,
-            'current_page': pagination.page,
-            'total_pages': pagination.pages,
-            'categories': formatted_categories,
+            'current_page': page,
+            'has_next': next_after_id is not None,
+            'next_after_id': next_after_id,
+            'categories': get_categories_map(),
             'current_category': None
-        })
-        
+        }
+
+        if count_requested():
+            response['total_questions'] = count_questions()
+            response['total_pages'] = math.ceil(response['total_questions'] / QUESTIONS_PER_PAGE)
+
+        return jsonify(response)
+
     @app.route('/questions/<int:question_id>', methods=['DELETE'])
     def delete_question(question_id):
         """
         Handles DELETE requests for a single question.
         """
-        question = Question.query.filter(Question.id == question_id).one_or_none()
+        question = db.session.get(Question, question_id)
 
         if question is None:
             abort(404)
@@ -83,7 +169,8 @@ def create_app(test_config=None):
                 'success': True,
                 'deleted': question_id
             })
-        except:
+        except SQLAlchemyError:
+            db.session.rollback()
             abort(422)
 
     @app.route('/questions', methods=['POST'])
@@ -91,26 +178,46 @@ def create_app(test_config=None):
         """
         Handles POST requests for creating a new question.
         """
+        fields = question_fields(request.get_json())
+
+        if fields is None:
+            abort(422)
+
+        try:
+            question_id, = Question.insert_many([fields])
+
+            return jsonify({
+                'success': True,
+                'created': question_id
+            })
+        except SQLAlchemyError:
+            db.session.rollback()
+            abort(422)
+
+    @app.route('/questions/bulk', methods=['POST'])
+    def create_questions():
+        """
+        Handles POST requests for creating many questions at once.
+        """
         body = request.get_json()
 
-        new_question = body.get('question', None)
-        new_answer = body.get('answer', None)
-        new_category = body.get('category', None)
-        new_difficulty = body.get('difficulty', None)
+        if not isinstance(body, list) or not body:
+            abort(422)
 
-        if not all([new_question, new_answer, new_category, new_difficulty]):
+        rows = [question_fields(item) for item in body]
+
+        if None in rows:
             abort(422)
 
         try:
-            question = Question(question=new_question, answer=new_answer,
-                                category=new_category, difficulty=new_difficulty)
-            question.insert()
+            question_ids = Question.insert_many(rows)
 
             return jsonify({
                 'success': True,
-                'created': question.id
+                'created': question_ids
             })
-        except:
+        except SQLAlchemyError:
+            db.session.rollback()
             abort(422)
 
     @app.route('/questions/search', methods=['POST'])
@@ -121,20 +228,27 @@ def create_app(test_config=None):
         body = request.get_json()
         search_term = body.get('searchTerm', None)
 
-        if search_term:
-            search_results = Question.query.filter(
-                Question.question.ilike(f'%{search_term}%')
-            ).all()
-
-            return jsonify({
-                'success': True,
-                'questions': [question.format() for question in search_results],
-                'total_questions': len(search_results),
-                'current_category': None
-            })
-        else:
+        if not search_term:
             abort(404)
 
+        pattern = f'%{search_term}%'
+        selection = select_questions()
+        selection += lambda s: s.where(Question.question.ilike(pattern)).order_by(Question.id)
+
+        def generate():
+            # results are unbounded, so rows are fetched and written out in batches
+            # from a server-side cursor instead of being collected into one list
+            rows = db.session.execute(selection, execution_options={'yield_per': STREAM_BATCH_SIZE}).mappings()
+            total_questions = 0
+
+            yield '{"success":true,"current_category":null,"questions":['
+            for row in rows:
+                yield (',' if total_questions else '') + app.json.dumps(dict(row))
+                total_questions += 1
+            yield f'],"total_questions":{total_questions}}}'
+
+        return app.response_class(stream_with_context(generate()), mimetype='application/json')
+
     @app.route('/questions/category', methods=['POST'])
     def get_questions_by_category():
         """
@@ -147,29 +261,38 @@ def create_app(test_config=None):
             abort(400) # Bad request if no category_id is provided
 
         try:
-            # Check if category exists
-            category = Category.query.filter_by(id=category_id).one_or_none()
-            if category is None:
-                abort(404) # Category not found
+            category_id = int(category_id)
+        except (TypeError, ValueError):
+            abort(400)
 
-            selection = Question.query.filter_by(category=category_id).order_by(Question.id)
-            total_questions = selection.count()
+        try:
+            # Check if category exists; the map is cached, so the page query is the only round-trip
+            category_type = get_categories_map().get(category_id)
+            if category_type is None:
+                abort(404) # Category not found
 
-            page = request.args.get('page', 1, type=int)
-            pagination = selection.paginate(page=page, per_page=QUESTIONS_PER_PAGE, error_out=False)
-            paginated_questions = [question.format() for question in pagination.items]
+            selection = select_questions()
+            selection += lambda s: s.where(Question.category == category_id)
+            paginated_questions, _, next_after_id = paginate_questions(selection)
 
             if not paginated_questions:
                 abort(404)
 
-            return jsonify({
+            response = {
                 'success': True,
                 'questions': paginated_questions,
-                'total_questions': total_questions,
-                'current_category': category.type
-            })
-        except:
-            abort(422) # Unprocessable entity for other errors
+                'has_next': next_after_id is not None,
+                'next_after_id': next_after_id,
+                'current_category': category_type
+            }
+
+            if count_requested():
+                response['total_questions'] = count_questions(category_id)
+
+            return jsonify(response)
+        except SQLAlchemyError:
+            db.session.rollback()
+            abort(422) # Unprocessable entity for database errors
 
     @app.route('/quizzes', methods=['POST'])
     def play_quiz():
@@ -187,29 +310,28 @@ def create_app(test_config=None):
             abort(400)
 
         try:
-            if quiz_category:
-                if quiz_category['id'] == 0: # 'ALL' category
-                    selection = Question.query.filter(Question.id.notin_(previous_questions))
-                else:
-                    selection = Question.query.filter(
-                        Question.category == quiz_category['id'],
-                        Question.id.notin_(previous_questions)
-                    )
-            else:
-                selection = Question.query.filter(Question.id.notin_(previous_questions))
-
-            questions = selection.all()
-
-            if questions:
-                question = random.choice(questions).format()
-            else:
-                question = None
+            category_id = int(quiz_category.get('id', 0)) if quiz_category else 0
+        except (AttributeError, TypeError, ValueError):
+            abort(400)
+
+        try:
+            selection = select_questions()
+            selection += lambda s: s.where(Question.id.notin_(previous_questions))
+            if category_id: # 0 is the 'ALL' category
+                selection += lambda s: s.where(Question.category == category_id)
+            # let the database pick the row, so only one question is fetched
+            selection += lambda s: s.order_by(func.random()).limit(1)
+
+            question = db.session.execute(selection).mappings().first()
+            if question is not None:
+                question = dict(question)
 
             return jsonify({
                 'success': True,
                 'question': question
             })
-        except:
+        except SQLAlchemyError:
+            db.session.rollback()
             abort(422)
 
     @app.errorhandler(404)
@@ -236,5 +358,28 @@ def create_app(test_config=None):
             "message": "bad request"
         }), 400
 
+    if test_config is None:
+        warm_up(app)
+
     return app
 
+def warm_up(app):
+    """
+    Runs the hot paths of GET /questions once, so the first real request finds the mappers
+    configured and the statement and data caches filled.
+    """
+    with app.test_request_context('/questions'):
+        try:
+            configure_mappers()
+            paginate_questions(select_questions())
+            get_categories_map()
+            count_questions()
+        except SQLAlchemyError:
+            # an unreachable database should not stop the app from starting
+            db.session.rollback()
+            app.logger.warning('Skipped warm-up, the database is not reachable', exc_info=True)
+        finally:
+            # drop the warm-up connection, so processes forked after this point
+            # (e.g. gunicorn --preload workers) never share its socket
+            db.session.remove()
+            db.engine.dispose(close=False)
@@ -0,0 +1,14 @@
+from a2wsgi import WSGIMiddleware
+
+from app import create_app
+from models import request_threads
+
+"""
+asgi_app
+    the Flask application wrapped for ASGI servers, e.g.
+    uvicorn asgi:asgi_app --workers 4 --loop uvloop --http httptools
+
+    Each request runs on one of WSGI_THREADS threads per worker process, so a
+    worker keeps serving other requests while one waits on the database.
+"""
+asgi_app = WSGIMiddleware(create_app(), workers=request_threads)
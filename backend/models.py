@@ -1,6 +1,7 @@
 import os
-from sqlalchemy import Column, String, Integer, ForeignKey
+from sqlalchemy import Column, String, Integer, ForeignKey, insert, lambda_stmt, make_url, select
 from flask_sqlalchemy import SQLAlchemy
+from flask_caching import Cache
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,9 +10,25 @@ database_name = os.getenv('DB_NAME')
 database_user = os.getenv('DB_USER')
 database_password = os.getenv('DB_PASSWORD')
 database_host = os.getenv('DB_HOST')
-database_path = f'postgresql://{database_user}:{database_password}@{database_host}/{database_name}'
+database_path = f'postgresql+psycopg://{database_user}:{database_password}@{database_host}/{database_name}'
+
+# requests a worker process serves at once; each holds at most one connection,
+# so the pool defaults to one connection per thread. (pool_size + max_overflow)
+# times the number of workers must stay below the server's max_connections
+request_threads = int(os.getenv('WSGI_THREADS', 10))
+database_pool_size = int(os.getenv('DB_POOL_SIZE', request_threads))
+database_max_overflow = int(os.getenv('DB_MAX_OVERFLOW', 0))
+
+# psycopg 3 prepares a statement server-side once a connection has run it this
+# many times; DB_PREPARE_THRESHOLD=none turns preparing off
+database_prepare_threshold = os.getenv('DB_PREPARE_THRESHOLD', '3')
+if database_prepare_threshold.lower() == 'none':
+    database_prepare_threshold = None
+else:
+    database_prepare_threshold = int(database_prepare_threshold)
 
 db = SQLAlchemy()
+cache = Cache()
 
 """
 setup_db(app)
@@ -20,13 +37,55 @@ setup_db(app)
 def setup_db(app, database_path=database_path):
     app.config['SQLALCHEMY_DATABASE_URI'] = database_path
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        # room for every statement shape the API issues, so none are recompiled
+        'query_cache_size': 1200,
+        'pool_size': database_pool_size,
+        'max_overflow': database_max_overflow,
+        # drop connections broken by a server restart instead of failing a request
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+    }
+    if make_url(database_path).get_driver_name() == 'psycopg':
+        app.config['SQLALCHEMY_ENGINE_OPTIONS']['connect_args'] = {
+            'prepare_threshold': database_prepare_threshold
+        }
+    app.config.setdefault('CACHE_TYPE', 'SimpleCache')
     db.init_app(app)
+    cache.init_app(app)
+
+"""
+count_questions(category_id=None)
+    number of questions, optionally within one category. COUNT(*) is a full
+    scan in Postgres, so the result is memoized and dropped whenever a
+    question is inserted or deleted.
+"""
+@cache.memoize(timeout=60)
+def count_questions(category_id=None):
+    query = Question.query
+    if category_id is not None:
+        query = query.filter(Question.category == category_id)
+    return query.count()
+
+"""
+get_categories_map()
+    {id: type} for every category. Categories rarely change, so the map is
+    memoized and dropped whenever a category is inserted or deleted.
+"""
+@cache.memoize(timeout=300)
+def get_categories_map():
+    stmt = lambda_stmt(lambda: select(Category.id, Category.type))
+    return dict(db.session.execute(stmt).all())
 
 """
 Question
 """
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        # serves the category filter and its ORDER BY id without a sort
+        db.Index('ix_questions_category_id', 'category', 'id'),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String, nullable=False)
@@ -43,6 +102,19 @@ class Question(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        cache.delete_memoized(count_questions)
+
+    @classmethod
+    def insert_many(cls, rows):
+        """
+        Inserts a list of column dicts in one executemany round-trip and
+        returns the new ids in the same order, without building ORM objects.
+        """
+        stmt = insert(cls).returning(cls.id, sort_by_parameter_order=True)
+        question_ids = db.session.scalars(stmt, rows).all()
+        db.session.commit()
+        cache.delete_memoized(count_questions)
+        return question_ids
 
     def update(self):
         db.session.commit()
@@ -50,6 +122,7 @@ class Question(db.Model):
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        cache.delete_memoized(count_questions)
 
     def format(self):
         return {
@@ -72,6 +145,16 @@ class Category(db.Model):
     def __init__(self, type):
         self.type = type
 
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+        cache.delete_memoized(get_categories_map)
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
+        cache.delete_memoized(get_categories_map)
+
     def format(self):
         return {
             'id': self.id,